@@ -4,10 +4,16 @@ Vercel Serverless Function for receiving and analyzing logs
 """
 
 from http.server import BaseHTTPRequestHandler
+import asyncio
+import atexit
+import ipaddress
 import json
 import os
-from datetime import datetime
+import queue
+from datetime import datetime, timezone
 import sys
+import threading
+import time
 import traceback
 
 # Handle imports safely to debug Vercel deployment issues
@@ -24,34 +30,385 @@ except Exception as e:
     # Define dummy Client for type hint compatibility
     Client = object
 
+try:
+    # orjson parses bytes directly and serializes straight to bytes
+    import orjson
+    
+    def _loads(body):
+        return orjson.loads(body)
+    
+    def _dumps(obj, indent=False):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+except ImportError:
+    def _loads(body):
+        return json.loads(body.decode('utf-8'))
+    
+    def _dumps(obj, indent=False):
+        return json.dumps(obj, indent=2 if indent else None).encode()
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+# Module-level singletons survive across warm invocations of the function
+_ANALYZER = LogAnalyzer() if LogAnalyzer else None
+_SUPABASE = None
+
+
+def _supabase() -> Client:
+    """Return the shared Supabase client, creating it on first use"""
+    global _SUPABASE
+    if _SUPABASE is None:
+        url = os.environ.get('SUPABASE_URL')
+        # Prefer Service Role Key for backend operations to bypass RLS
+        key = os.environ.get('SUPABASE_SERVICE_ROLE_KEY') or os.environ.get('SUPABASE_ANON_KEY')
+        
+        if not url or not key:
+            raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY environment variables")
+        
+        _SUPABASE = create_client(url, key)
+    return _SUPABASE
+
+
+_TS_CACHE = {'t': 0, 's': ''}
+
+
+def _now_iso():
+    """Current UTC time as an ISO string, rebuilt at most once per second"""
+    now = int(time.time())
+    if now != _TS_CACHE['t']:
+        _TS_CACHE['s'] = datetime.fromtimestamp(now, timezone.utc).isoformat()
+        _TS_CACHE['t'] = now
+    return _TS_CACHE['s']
+
+
+# Limits from the log_events schema. Events are validated against them before
+# queueing, since one row the database rejects fails its whole batch insert.
+_TEXT_FIELDS = (
+    'source', 'event_type', 'message', 'source_ip', 'destination_ip', 'user_agent', 'username',
+)
+_NOT_NULL_FIELDS = ('source', 'event_type', 'message')
+_MAX_LENGTHS = {'source': 255, 'event_type': 100, 'username': 255}
+
+
+def _contains_nul(value):
+    """Check a JSON value for U+0000, which Postgres text and jsonb cannot store"""
+    if isinstance(value, str):
+        return '\x00' in value
+    if isinstance(value, dict):
+        return any(_contains_nul(k) or _contains_nul(v) for k, v in value.items())
+    if isinstance(value, list):
+        return any(_contains_nul(v) for v in value)
+    return False
+
+
+def _invalid_field(data):
+    """Return why the database would reject the event, or None if it is storable"""
+    for name in _TEXT_FIELDS:
+        value = data.get(name)
+        if value is None:
+            if name in _NOT_NULL_FIELDS:
+                return f'Invalid {name}: must not be null'
+            continue
+        if isinstance(value, (dict, list)):
+            return f'Invalid {name}: must not be an object or array'
+        # Numbers and booleans are stored as their text, so check that text
+        value = str(value)
+        if name in _MAX_LENGTHS and len(value) > _MAX_LENGTHS[name]:
+            return f'Invalid {name}: longer than {_MAX_LENGTHS[name]} characters'
+        if '\x00' in value:
+            return f'Invalid {name}: contains a NUL character'
+    
+    for name in ('source_ip', 'destination_ip'):
+        if data.get(name) is not None:
+            try:
+                ipaddress.ip_interface(str(data[name]))
+            except ValueError:
+                return f'Invalid {name}: not an IP address'
+    
+    if 'timestamp' in data:
+        try:
+            datetime.fromisoformat(data['timestamp'])
+        except (TypeError, ValueError):
+            return 'Invalid timestamp: must be an ISO 8601 string'
+    
+    metadata = data.get('metadata')
+    if metadata is not None:
+        if not isinstance(metadata, dict):
+            return 'Invalid metadata: must be an object'
+        if _contains_nul(metadata):
+            return 'Invalid metadata: contains a NUL character'
+    return None
+
+
+# Requests only enqueue events; a background thread drains the queue and
+# writes each batch with one multi-row insert
+QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))
+BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 200))
+FLUSH_MS = int(os.environ.get('INGEST_FLUSH_MS', 50))
+
+# Backoff between retries of a batch that failed for a transient reason,
+# and how many attempts it gets before it is dropped
+RETRY_MIN_S = 0.1
+RETRY_MAX_S = 5.0
+MAX_ATTEMPTS = 8
+# How long new events are refused after a batch is dropped on a write failure
+FAILURE_HOLD_S = 30
+# How long exit waits for the drainer to write what it still holds
+SHUTDOWN_TIMEOUT_S = 10
+
+_COLUMNS = (
+    'timestamp', 'source', 'severity', 'event_type', 'message', 'source_ip',
+    'destination_ip', 'user_agent', 'username', 'metadata', 'is_anomaly', 'anomaly_score',
+)
+
+
+_QUEUE = queue.Queue(maxsize=QUEUE_SIZE)
+_STOP = threading.Event()
+
+
+def _next_batch():
+    """
+    Block for the next event, then collect more until the batch is full or
+    FLUSH_MS passes. Returns an empty batch once stopping with nothing queued.
+    """
+    while True:
+        try:
+            batch = [_QUEUE.get(timeout=0.5)]
+            break
+        except queue.Empty:
+            if _STOP.is_set():
+                return []
+    deadline = time.monotonic() + FLUSH_MS / 1000
+    
+    while len(batch) < BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_QUEUE.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+class DatabaseError(Exception):
+    """Raised when the database rejects an insert"""
+
+
+class RejectedRowsError(DatabaseError):
+    """Raised when the rows themselves are invalid, so retrying the same batch cannot succeed"""
+
+
+class DatabaseConfigError(DatabaseError):
+    """Raised when no retry can succeed until the configuration changes (credentials, privileges, schema)"""
+
+
+def _database_error(sqlstate, message):
+    sqlstate = sqlstate or ''
+    # SQLSTATE classes 22 (data exception) and 23 (constraint violation) blame the rows
+    if sqlstate[:2] in ('22', '23'):
+        return RejectedRowsError(message)
+    # Classes 28 (authorization) and 42 (privileges, missing table or column),
+    # PostgREST's own codes and HTTP errors without a SQLSTATE are permanent
+    if not sqlstate or sqlstate[:2] in ('28', '42') or sqlstate.startswith('PGRST'):
+        return DatabaseConfigError(message)
+    return DatabaseError(message)
+
+
+# Last write failure that dropped a batch, reported to clients for FAILURE_HOLD_S
+_WRITE_FAILURE = {'error': None, 'at': 0.0}
+
+
+def _write_failure():
+    """Return the recent write failure clients should be told about, if any"""
+    if _WRITE_FAILURE['error'] and time.monotonic() - _WRITE_FAILURE['at'] < FAILURE_HOLD_S:
+        return _WRITE_FAILURE['error']
+    return None
+
+
+def _drop_batch(batch, error):
+    print(f"Dropping {len(batch)} events: {error}", file=sys.stderr)
+    _WRITE_FAILURE['error'] = str(error)
+    _WRITE_FAILURE['at'] = time.monotonic()
+
+
+# With SUPABASE_DB_URL set, rows go straight to Postgres instead of through
+# the PostgREST API
+DB_URL = os.environ.get('SUPABASE_DB_URL')
+
+# Columns are sent as typed arrays and unnested server-side, so a batch of any
+# size is one prepared statement. Text values are cast in SQL so Postgres
+# parses timestamps, IPs and JSON exactly as PostgREST would.
+_INSERT_SQL = """
+INSERT INTO log_events (
+    timestamp, source, severity, event_type, message, source_ip,
+    destination_ip, user_agent, username, metadata, is_anomaly, anomaly_score
+)
+SELECT
+    e.ts::timestamptz, e.source, e.severity, e.event_type, e.message, e.source_ip::inet,
+    e.destination_ip::inet, e.user_agent, e.username, e.metadata::jsonb, e.is_anomaly, e.anomaly_score
+FROM unnest(
+    $1::text[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[],
+    $7::text[], $8::text[], $9::text[], $10::text[], $11::boolean[], $12::float8[]
+) AS e(
+    ts, source, severity, event_type, message, source_ip,
+    destination_ip, user_agent, username, metadata, is_anomaly, anomaly_score
+)
+"""
+
+_LOOP = None
+_POOL = None
+_DB_LOCK = threading.Lock()
+
+
+async def _pool():
+    """Return the shared asyncpg pool, creating it on first use"""
+    global _POOL
+    if _POOL is None:
+        # No named prepared statements, so Supabase's transaction-mode pooler works too
+        _POOL = await asyncpg.create_pool(
+            DB_URL, min_size=1, max_size=4, statement_cache_size=0
+        )
+    return _POOL
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+async def _insert_batch_pg(batch):
+    """Insert a batch of events over the Postgres binary protocol"""
+    # Transpose the rows so each column maps onto one array parameter
+    args = [[_text(event[name]) for event in batch] for name in _COLUMNS[:9]]
+    args.append([_dumps(event['metadata']).decode() for event in batch])
+    args.append([event['is_anomaly'] for event in batch])
+    args.append([event['anomaly_score'] for event in batch])
+    
+    pool = await _pool()
+    async with pool.acquire() as conn:
+        await conn.execute(_INSERT_SQL, *args)
+
+
+def _insert_batch(batch):
+    """Write a batch of events with a single multi-row insert"""
+    global _LOOP
+    if DB_URL and asyncpg is not None:
+        # The pool is bound to one event loop, so every call reuses the same loop
+        with _DB_LOCK:
+            if _LOOP is None:
+                _LOOP = asyncio.new_event_loop()
+            try:
+                _LOOP.run_until_complete(_insert_batch_pg(batch))
+            except asyncpg.PostgresError as e:
+                raise _database_error(e.sqlstate, str(e)) from e
+        return
+    
+    try:
+        result = _supabase().table('log_events').insert(batch).execute()
+    except Exception as e:
+        # postgrest's APIError carries the Postgres SQLSTATE, or None for a
+        # plain HTTP error, as its code; network errors have no code at all
+        if not hasattr(e, 'code'):
+            raise
+        raise _database_error(e.code, str(e)) from e
+    
+    # Explicitly check for database errors from Supabase
+    if hasattr(result, 'error') and result.error:
+        raise _database_error(getattr(result.error, 'code', None), str(result.error))
+
+
+def _write_batch(batch):
+    """
+    Insert a batch, dropping only the rows the database rejects. Transient
+    failures are retried up to MAX_ATTEMPTS; permanent ones drop the batch.
+    """
+    delay = RETRY_MIN_S
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            _insert_batch(batch)
+            return
+        except RejectedRowsError as e:
+            if len(batch) == 1:
+                print(f"Dropping event rejected by the database: {e}", file=sys.stderr)
+                return
+            # Split the batch so the valid rows around the offending ones still land
+            middle = len(batch) // 2
+            _write_batch(batch[:middle])
+            _write_batch(batch[middle:])
+            return
+        except DatabaseConfigError as e:
+            _drop_batch(batch, e)
+            return
+        except Exception as e:
+            traceback.print_exc()
+            if _STOP.is_set() or attempt == MAX_ATTEMPTS:
+                _drop_batch(batch, e)
+                return
+            _STOP.wait(delay)
+            delay = min(delay * 2, RETRY_MAX_S)
+
+
+def _drain_queue():
+    """Background loop writing queued events to the database until stopped and empty"""
+    while True:
+        batch = _next_batch()
+        if not batch:
+            return
+        _write_batch(batch)
+
+
+_DRAINER = threading.Thread(target=_drain_queue, name='ingest-drainer', daemon=True)
+if not import_error:
+    _DRAINER.start()
+
+
+@atexit.register
+def _stop_drainer():
+    """Let the drainer write its current batch and everything still queued before exit"""
+    _STOP.set()
+    if _DRAINER.is_alive():
+        _DRAINER.join(SHUTDOWN_TIMEOUT_S)
+
 
 class handler(BaseHTTPRequestHandler):
     
-    def _set_headers(self, status_code=200, content_type='application/json'):
+    def _set_headers(self, status_code=200, content_type='application/json', content_length=None):
         """Set response headers"""
         self.send_response(status_code)
         self.send_header('Content-type', content_type)
+        if content_length is not None:
+            # An explicit length lets the connection be kept alive after the body
+            self.send_header('Content-Length', str(content_length))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
         self.end_headers()
     
-    def _get_supabase_client(self) -> Client:
-        """Initialize Supabase client"""
-        url = os.environ.get('SUPABASE_URL')
-        # Prefer Service Role Key for backend operations to bypass RLS
-        key = os.environ.get('SUPABASE_SERVICE_ROLE_KEY') or os.environ.get('SUPABASE_ANON_KEY')
-        
-        if not url or not key:
-            raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY environment variables")
-        
-        return create_client(url, key)
+    def _send_json(self, status_code, obj, indent=False):
+        """Serialize a response body once and send it with its Content-Length"""
+        payload = _dumps(obj, indent)
+        self._set_headers(status_code, content_length=len(payload))
+        self.wfile.write(payload)
     
     def _read_body(self):
         """Read and parse request body"""
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length)
-        return json.loads(body.decode('utf-8'))
+        # A negative length reads nothing, so the empty body fails as invalid JSON
+        content_length = max(int(self.headers.get('Content-Length', 0)), 0)
+        
+        # Read straight into one preallocated buffer rather than building an
+        # intermediate bytes copy of the payload
+        body = bytearray(content_length)
+        received = 0
+        with memoryview(body) as view:
+            while received < content_length:
+                n = self.rfile.readinto(view[received:])
+                if not n:
+                    break
+                received += n
+        del body[received:]
+        return _loads(body)
     
     def do_OPTIONS(self):
         """Handle OPTIONS request for CORS"""
@@ -61,38 +418,41 @@ class handler(BaseHTTPRequestHandler):
         """Handle POST requests for log ingestion"""
         # Check for critical import errors during initialization
         if import_error:
-            self._set_headers(500)
-            self.wfile.write(json.dumps({
+            self._send_json(500, {
                 'error': 'Server Configuration Error',
                 'details': import_error
-            }).encode())
+            })
             return
 
         try:
             data = self._read_body()
             
             required_fields = ['source', 'severity', 'event_type', 'message']
-            for field in required_fields:
-                if field not in data:
-                    self._set_headers(400)
-                    self.wfile.write(json.dumps({
-                        'error': f'Missing required field: {field}'
-                    }).encode())
+            for name in required_fields:
+                if name not in data:
+                    self._send_json(400, {
+                        'error': f'Missing required field: {name}'
+                    })
                     return
             
             valid_severities = ['critical', 'high', 'medium', 'low', 'info']
             if data['severity'] not in valid_severities:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({
+                self._send_json(400, {
                     'error': f'Invalid severity. Must be one of: {", ".join(valid_severities)}'
-                }).encode())
+                })
                 return
             
-            analyzer = LogAnalyzer()
-            analysis = analyzer.analyze_event(data)
+            error = _invalid_field(data)
+            if error:
+                self._send_json(400, {
+                    'error': error
+                })
+                return
+            
+            analysis = _ANALYZER.analyze_event(data)
             
             event = {
-                'timestamp': data.get('timestamp', datetime.utcnow().isoformat()),
+                'timestamp': data.get('timestamp', _now_iso()),
                 'source': data['source'],
                 'severity': data['severity'],
                 'event_type': data['event_type'],
@@ -110,51 +470,57 @@ class handler(BaseHTTPRequestHandler):
                 'anomaly_score': analysis['anomaly_score'],
             }
             
-            supabase = self._get_supabase_client()
-            result = supabase.table('log_events').insert(event).execute()
+            # Surface missing configuration now rather than in the background writer
+            if not (DB_URL and asyncpg is not None):
+                _supabase()
             
-            # Explicitly check for database errors from Supabase
-            if hasattr(result, 'error') and result.error:
-                self._set_headers(500)
-                self.wfile.write(json.dumps({
+            # Stop acknowledging events while writes are known to be failing
+            failure = _write_failure()
+            if failure:
+                self._send_json(500, {
                     'error': 'Database operation failed',
-                    'details': str(result.error)
-                }).encode())
+                    'details': failure
+                })
                 return
-
-            self._set_headers(201)
+            
+            try:
+                _QUEUE.put_nowait(event)
+            except queue.Full:
+                # Backpressure: the database is not keeping up with ingestion
+                self._send_json(503, {
+                    'error': 'Ingestion queue is full, retry later'
+                })
+                return
+            
             response = {
                 'success': True,
-                'message': 'Event logged successfully',
-                'event_id': result.data[0]['id'] if result.data and len(result.data) > 0 else None,
+                'queued': True,
+                'message': 'Event queued for storage',
+                'event_id': None,
                 'analysis': {
                     'is_anomaly': analysis['is_anomaly'],
                     'anomaly_score': analysis['anomaly_score'],
                     'detected_attacks': analysis['detected_attacks'],
                 }
             }
-            self.wfile.write(json.dumps(response).encode())
+            self._send_json(202, response)
             
         except json.JSONDecodeError:
-            self._set_headers(400)
-            self.wfile.write(json.dumps({
+            self._send_json(400, {
                 'error': 'Invalid JSON in request body'
-            }).encode())
+            })
         except ValueError as e:
-            self._set_headers(500)
-            self.wfile.write(json.dumps({
+            self._send_json(500, {
                 'error': str(e)
-            }).encode())
+            })
         except Exception as e:
-            self._set_headers(500)
-            self.wfile.write(json.dumps({
+            self._send_json(500, {
                 'error': 'Internal server error',
                 'details': str(e)
-            }).encode())
+            })
     
     def do_GET(self):
         """Handle GET requests - return API info"""
-        self._set_headers(200)
         response = {
             'name': 'SIEM Lite Log Ingestion API',
             'version': '1.0.0',
@@ -163,4 +529,4 @@ class handler(BaseHTTPRequestHandler):
                 'GET /api/ingest': 'API information'
             }
         }
-        self.wfile.write(json.dumps(response, indent=2).encode())
\ No newline at end of file
+        self._send_json(200, response, indent=True)
\ No newline at end of file
@@ -1,59 +1,299 @@
-import re
+import functools
+import re as stdlib_re
+import threading
+from typing import Any
+
+try:
+    # RE2 guarantees linear-time matching on attacker-controlled messages
+    import re2 as re  # type: ignore
+except ImportError:
+    import re  # type: ignore
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None  # type: ignore[assignment]
+
+try:
+    import ahocorasick  # type: ignore
+except ImportError:
+    ahocorasick = None
+
+# Common attack patterns based on README features.
+# Patterns are written in lowercase and matched against the lowercased message.
+SQL_INJECTION_PATTERNS: list[str] = [
+    r"or '1'='1", r"union select", r"admin' --", r"sleep\(",
+    r"drop table", r"information_schema"
+]
+XSS_PATTERNS: list[str] = [
+    r"<script>", r"javascript:", r"onerror=", r"onload=",
+    r"document\.cookie", r"alert\("
+]
+PATH_TRAVERSAL_PATTERNS: list[str] = [
+    r"\.\./", r"/etc/passwd", r"c:\\windows", r"%2e%2e%2f"
+]
+COMMAND_INJECTION_PATTERNS: list[str] = [
+    r"; cat", r"\| ls", r"&&", r"\$\(", r"eval\("
+]
+LOG4SHELL_PATTERNS: list[str] = [
+    r"\$\{jndi:"
+]
+
+# Cheap substring prefilter: every pattern above contains at least one of
+# these atoms, so a message containing none of them cannot match.
+PREFILTER_ATOMS: tuple[str, ...] = (
+    "'", "<", "(", "$", ";", "|", "&&", "../", "%2e",
+    "union", "drop", "information_schema", "javascript:", "onerror=",
+    "onload=", "document.cookie", "/etc/passwd", "c:\\windows",
+)
+
+# Score contributions; the per-event score is their sum, capped at 1.0
+ATTACK_WEIGHT = 0.4
+_SEVERITY_WEIGHTS: dict[str, float] = {"critical": 0.3, "high": 0.3}
+
+# Messages longer than this bypass the result cache
+MAX_CACHED_INPUT_LEN = 2048
+
+_REGEX_META = frozenset(".^$*+?{}[]|()")
+
+
+def _compile_union(patterns: list[str]) -> Any:
+    """Compile a list of patterns into a single alternation."""
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+def _literal(pattern: str) -> str | None:
+    """Return the text a pattern matches verbatim, or None if it needs a regex engine."""
+    chars: list[str] = []
+    escaped = False
+    for ch in pattern:
+        if escaped:
+            # \d, \s, \b etc. are character classes or assertions, not literals
+            if ch.isalnum():
+                return None
+            chars.append(ch)
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch in _REGEX_META:
+            return None
+        else:
+            chars.append(ch)
+    return "".join(chars)
+
+
+# Compiled once at import so each category costs a single scan per event
+SQL_INJECTION_RE = _compile_union(SQL_INJECTION_PATTERNS)
+XSS_RE = _compile_union(XSS_PATTERNS)
+PATH_TRAVERSAL_RE = _compile_union(PATH_TRAVERSAL_PATTERNS)
+COMMAND_INJECTION_RE = _compile_union(COMMAND_INJECTION_PATTERNS)
+LOG4SHELL_RE = _compile_union(LOG4SHELL_PATTERNS)
+
+# Immutable (attack type, compiled regex) pairs, in reporting order
+_ATTACK_TABLE: tuple[tuple[str, Any], ...] = (
+    ("SQL Injection", SQL_INJECTION_RE),
+    ("XSS", XSS_RE),
+    ("Path Traversal", PATH_TRAVERSAL_RE),
+    ("Command Injection", COMMAND_INJECTION_RE),
+    ("Log4Shell", LOG4SHELL_RE),
+)
+
+ATTACK_PATTERNS: dict[str, list[str]] = {
+    "SQL Injection": SQL_INJECTION_PATTERNS,
+    "XSS": XSS_PATTERNS,
+    "Path Traversal": PATH_TRAVERSAL_PATTERNS,
+    "Command Injection": COMMAND_INJECTION_PATTERNS,
+    "Log4Shell": LOG4SHELL_PATTERNS,
+}
+
+# Lowercasing and the byte-oriented engines miss Unicode case variants such
+# as "UNİON" or "<ſcript>", so non-ASCII messages go through the stdlib
+# engine's full case-insensitive matching instead
+_UNICODE_ATTACK_TABLE: tuple[tuple[str, Any], ...] = tuple(
+    (
+        attack_type,
+        stdlib_re.compile("|".join(f"(?:{p})" for p in patterns), stdlib_re.IGNORECASE),
+    )
+    for attack_type, patterns in ATTACK_PATTERNS.items()
+)
+
+
+def _build_hyperscan_db() -> tuple[Any, Any, list[str]]:
+    """Compile every attack pattern into one Hyperscan block-mode database."""
+    expressions: list[bytes] = []
+    categories: list[str] = []
+    for attack_type, patterns in ATTACK_PATTERNS.items():
+        for pattern in patterns:
+            expressions.append(pattern.encode())
+            categories.append(attack_type)
+
+    db = hyperscan.Database()
+    db.compile(
+        expressions=expressions,
+        ids=list(range(len(expressions))),
+        elements=len(expressions),
+        flags=hyperscan.HS_FLAG_SINGLEMATCH,
+    )
+    # Prototype scratch; each scanning thread works on its own clone
+    return db, hyperscan.Scratch(db), categories
+
+
+def _on_hyperscan_match(pattern_id: int, start: int, end: int, flags: int, hits: set[str]) -> None:
+    hits.add(_HS_CATEGORIES[pattern_id])
+
+
+def _ordered_attacks(hits: set[str]) -> list[str]:
+    """
+    Collapse attack types reported in any order, possibly more than once,
+    into a duplicate-free list in _ATTACK_TABLE order.
+    """
+    return [attack_type for attack_type, _ in _ATTACK_TABLE if attack_type in hits]
+
+
+def _build_literal_matcher() -> tuple[Any, tuple[tuple[str, Any], ...]]:
+    """
+    Load every literal attack pattern into one Aho-Corasick automaton and
+    compile the rest into per-category regexes.
+    """
+    automaton = ahocorasick.Automaton()
+    remainder = []
+    for attack_type, patterns in ATTACK_PATTERNS.items():
+        regex_patterns = []
+        for pattern in patterns:
+            literal = _literal(pattern)
+            if literal is None:
+                regex_patterns.append(pattern)
+            else:
+                automaton.add_word(literal, attack_type)
+        if regex_patterns:
+            remainder.append((attack_type, _compile_union(regex_patterns)))
+    automaton.make_automaton()
+    return automaton, tuple(remainder)
+
+
+_HS_DB: Any = None
+_HS_SCRATCH: Any = None
+_HS_CATEGORIES: list[str] = []
+if hyperscan is not None:
+    _HS_DB, _HS_SCRATCH, _HS_CATEGORIES = _build_hyperscan_db()
+
+# Scratch space can only be used by one scan at a time
+_HS_LOCAL = threading.local()
+
+
+def _hs_scratch() -> Any:
+    """Return this thread's Hyperscan scratch, cloning it on first use."""
+    scratch = getattr(_HS_LOCAL, "scratch", None)
+    if scratch is None:
+        scratch = _HS_LOCAL.scratch = _HS_SCRATCH.clone()
+    return scratch
+
+
+_ATTACK_AUTOMATON: Any = None
+_ATTACK_REGEX_REMAINDER: tuple[tuple[str, Any], ...] = ()
+# Only needed when Hyperscan is unavailable, so cold starts skip building it otherwise
+if _HS_DB is None and ahocorasick is not None:
+    _ATTACK_AUTOMATON, _ATTACK_REGEX_REMAINDER = _build_literal_matcher()
+
+
+def _scan_attacks(message: str) -> list[str]:
+    """Return the attack types whose patterns match the lowercased message."""
+    if _HS_DB is not None:
+        # Single pass over the message for every pattern at once
+        hits: set[str] = set()
+        _HS_DB.scan(
+            message.encode('utf-8', 'surrogatepass'),
+            match_event_handler=_on_hyperscan_match,
+            context=hits,
+            scratch=_hs_scratch(),
+        )
+        return _ordered_attacks(hits)
+
+    if _ATTACK_AUTOMATON is not None:
+        # One pass for all literal needles, then only the true regexes
+        hits = {attack_type for _, attack_type in _ATTACK_AUTOMATON.iter(message)}
+        hits.update(
+            attack_type for attack_type, regex in _ATTACK_REGEX_REMAINDER
+            if regex.search(message)
+        )
+        return _ordered_attacks(hits)
+
+    # Fallback: one scan per attack type, so each type is reported once
+    return [
+        attack_type for attack_type, regex in _ATTACK_TABLE
+        if regex.search(message)
+    ]
+
+
+def _scan_attacks_unicode(message: str) -> list[str]:
+    """Return the attack types whose patterns match the message, folding Unicode case."""
+    return [
+        attack_type for attack_type, regex in _UNICODE_ATTACK_TABLE
+        if regex.search(message)
+    ]
+
+
+# (detected attacks, severity weight, risk factors)
+_Inspection = tuple[tuple[str, ...], float, tuple[str, ...]]
+
+
+def _inspect_fields(message: str, severity: str) -> _Inspection:
+    """Run every check that depends on the event's message and severity."""
+    risk_factors: list[str] = []
+
+    # Check for attack patterns, skipping the scan for benign messages
+    if not message.isascii():
+        # The prefilter atoms cannot see Unicode case variants either
+        detected_attacks = _scan_attacks_unicode(message)
+    else:
+        msg_lower = message.lower()
+        if any(atom in msg_lower for atom in PREFILTER_ATOMS):
+            detected_attacks = _scan_attacks(msg_lower)
+        else:
+            detected_attacks = []
+
+    # Check severity
+    severity_weight = _SEVERITY_WEIGHTS.get(severity, 0.0)
+    if severity_weight:
+        risk_factors.append(f"High severity event: {severity}")
+
+    # Tuples, since cached results are shared between callers
+    return tuple(detected_attacks), severity_weight, tuple(risk_factors)
+
+
+# Template log lines repeat heavily, so identical inputs reuse the last result
+_inspect_cached = functools.lru_cache(maxsize=4096)(_inspect_fields)
+
 
 class LogAnalyzer:
     """
     Analyzes log events for security threats and anomalies.
     """
-    
-    def __init__(self):
-        # Common attack patterns based on README features
-        self.patterns = {
-            "SQL Injection": [
-                r"OR '1'='1", r"UNION SELECT", r"admin' --", r"SLEEP\(", 
-                r"DROP TABLE", r"information_schema"
-            ],
-            "XSS": [
-                r"<script>", r"javascript:", r"onerror=", r"onload=", 
-                r"document\.cookie", r"alert\("
-            ],
-            "Path Traversal": [
-                r"\.\./", r"/etc/passwd", r"c:\\windows", r"%2e%2e%2f"
-            ],
-            "Command Injection": [
-                r"; cat", r"\| ls", r"&&", r"\$\(", r"eval\("
-            ],
-            "Log4Shell": [
-                r"\$\{jndi:"
-            ]
-        }
 
-    def analyze_event(self, data):
+    def _inspect(self, data: dict[str, Any]) -> _Inspection:
         """
-        Analyze a single log event for anomalies.
+        Return the detected attacks, severity weight and risk factors for a
+        single event.
         """
-        score = 0.0
-        detected_attacks = []
-        risk_factors = []
-        
         message = str(data.get('message', ''))
-        
-        # Check for attack patterns
-        for attack_type, patterns in self.patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, message, re.IGNORECASE):
-                    score += 0.4
-                    detected_attacks.append(attack_type)
-                    # Break inner loop to avoid duplicate counts for same attack type
-                    break
-        
-        # Check severity
-        if data.get('severity') in ['critical', 'high']:
-            score += 0.3
-            risk_factors.append(f"High severity event: {data.get('severity')}")
-            
+        severity = str(data.get('severity'))
+
+        # Very long messages are analyzed uncached rather than retained by the cache
+        if len(message) > MAX_CACHED_INPUT_LEN:
+            return _inspect_fields(message, severity)
+        return _inspect_cached(message, severity)
+
+    def analyze_event(self, data: dict[str, Any]) -> dict[str, Any]:
+        """
+        Analyze a single log event for anomalies.
+        """
+        detected_attacks, severity_weight, risk_factors = self._inspect(data)
+
+        score = ATTACK_WEIGHT * len(detected_attacks) + severity_weight
+
         return {
             "is_anomaly": score >= 0.5 or len(detected_attacks) > 0,
             "anomaly_score": min(score, 1.0),
-            "detected_attacks": detected_attacks,
-            "risk_factors": risk_factors
-        }
\ No newline at end of file
+            "detected_attacks": list(detected_attacks),
+            "risk_factors": list(risk_factors)
+        }
@@ -7,14 +7,31 @@ This script simulates various security events for testing purposes
 import requests
 import random
 import time
-from datetime import datetime
 import json
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+
+    def _encode(event):
+        return orjson.dumps(event)
+except ImportError:
+    def _encode(event):
+        return json.dumps(event, separators=(',', ':')).encode('utf-8')
 
 # Configuration
 # IMPORTANT: This URL must point to your Vercel deployment's API endpoint.
 # It should look like: https://your-app-name.vercel.app/api/ingest
 API_ENDPOINT = "https://siem-lite.vercel.app/api/ingest"
 
+# One pooled session so repeated sends reuse the keep-alive connection
+# instead of paying a new TCP+TLS handshake per event
+_SESSION = requests.Session()
+_SESSION.headers.update({"Content-Type": "application/json"})
+_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
+
 # Sample data for generating realistic logs
 SOURCES = [
     "web_server_prod",
@@ -131,13 +148,9 @@ def generate_failed_login_burst(ip, count=7):
 def send_event(event):
     """Send an event to the SIEM API"""
     try:
-        response = requests.post(
-            API_ENDPOINT,
-            json=event,
-            headers={"Content-Type": "application/json"}
-        )
+        response = _SESSION.post(API_ENDPOINT, data=_encode(event))
         
-        if response.status_code in [200, 201]:
+        if response.status_code in [200, 201, 202]:
             result = response.json()
             status = "🔴 ANOMALY" if result.get('analysis', {}).get('is_anomaly') else "🟢 NORMAL"
             print(f"{status} | {event['severity'].upper():8} | {event['event_type']:20} | Score: {result.get('analysis', {}).get('anomaly_score', 0):.2f}")